@@ -12,20 +12,32 @@ environment variable before executing the script.
 
 from __future__ import annotations
 
+import asyncio
+import html
 import logging
 import os
+from collections import Counter
 from dataclasses import dataclass
-from typing import Dict, List, MutableMapping
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, List, MutableMapping, Tuple
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import (CallbackQuery, InlineKeyboardButton,
+                      InlineKeyboardMarkup, Update)
 from telegram.constants import ParseMode
-from telegram.ext import (ApplicationBuilder, CallbackQueryHandler,
-                          CommandHandler, ContextTypes, MessageHandler,
-                          filters)
+from telegram.ext import (Application, ApplicationBuilder,
+                          CallbackQueryHandler, CommandHandler, ContextTypes,
+                          Defaults, MessageHandler, filters)
 
 
 LOGGER = logging.getLogger(__name__)
 
+# Delay used to coalesce keyboard refreshes after rapid "add to cart" taps.
+ADD_DEBOUNCE_SECONDS = 0.25
+
+# Pending keyboard refreshes keyed by (chat_id, message_id).  This is transient
+# scheduling state, so it is kept out of the persisted ``user_data``.
+_PENDING_ADD_EDITS: Dict[Tuple[int, int], asyncio.TimerHandle] = {}
+
 
 @dataclass(frozen=True)
 class Sweet:
@@ -86,14 +98,23 @@ SWEET_CATALOGUE: Dict[str, List[Sweet]] = {
     ],
 }
 
+_CATEGORY_TITLES: Dict[str, str] = {
+    "chocolate": "Шоколад",
+    "caramel": "Карамель",
+    "cookies": "Печенье",
+}
 
-def _get_cart(user_data: MutableMapping[str, object]) -> Dict[str, int]:
+SWEETS_BY_ID: Dict[str, Sweet] = {
+    sweet.id: sweet for sweets in SWEET_CATALOGUE.values() for sweet in sweets
+}
+
+
+def _get_cart(user_data: MutableMapping[str, object]) -> Counter[str]:
     """Return the shopping cart stored in ``user_data``."""
 
-    cart = user_data.setdefault("cart", {})
-    if not isinstance(cart, dict):  # Defensive programming in case of misuse.
-        user_data["cart"] = {}
-        cart = user_data["cart"]
+    cart = user_data.get("cart")
+    if cart is None:
+        user_data["cart"] = cart = Counter()
     return cart  # type: ignore[return-value]
 
 
@@ -103,83 +124,94 @@ def _format_currency(amount_rub: int) -> str:
     return f"{amount_rub} ₽"
 
 
+ITEM_HTML: Dict[str, str] = {
+    sweet.id: (
+        f"<b>{sweet.name}</b>\n"
+        f"Цена: {_format_currency(sweet.price_rub)}\n\n"
+        f"{sweet.description}"
+    )
+    for sweet in SWEETS_BY_ID.values()
+}
+
+BUTTON_LABEL: Dict[str, str] = {
+    sweet.id: f"{sweet.name} — {_format_currency(sweet.price_rub)}"
+    for sweet in SWEETS_BY_ID.values()
+}
+
+_BTN_BACK_MENU = InlineKeyboardButton("⬅️ Назад", callback_data="menu")
+_BTN_BACK_PRODUCTS = InlineKeyboardButton("⬅️ К товарам", callback_data="menu")
+_BTN_CART_VIEW = InlineKeyboardButton("🛒 Корзина", callback_data="cart:view")
+_BTN_CART_OPEN = InlineKeyboardButton("🛒 Открыть корзину", callback_data="cart:view")
+_BTN_CART_CLEAR = InlineKeyboardButton("Очистить", callback_data="cart:clear")
+_BTN_CHECKOUT = InlineKeyboardButton("Оформить заказ", callback_data="cart:checkout")
+
+_CART_KEYBOARD_EMPTY = InlineKeyboardMarkup([[_BTN_BACK_PRODUCTS]])
+_CART_KEYBOARD_FILLED = InlineKeyboardMarkup(
+    [[_BTN_CART_CLEAR, _BTN_CHECKOUT], [_BTN_BACK_PRODUCTS]]
+)
+
+
+@lru_cache(maxsize=None)
 def _build_categories_keyboard() -> InlineKeyboardMarkup:
     buttons = [
         [InlineKeyboardButton(text=_category_title(category), callback_data=f"cat:{category}")]
         for category in SWEET_CATALOGUE
     ]
-    buttons.append([InlineKeyboardButton(text="🛒 Корзина", callback_data="cart:view")])
+    buttons.append([_BTN_CART_VIEW])
     return InlineKeyboardMarkup(buttons)
 
 
+@lru_cache(maxsize=None)
 def _build_sweets_keyboard(category: str) -> InlineKeyboardMarkup:
     sweets = SWEET_CATALOGUE.get(category)
     if not sweets:
-        return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Назад", callback_data="menu")]])
+        return InlineKeyboardMarkup([[_BTN_BACK_MENU]])
 
     buttons: List[List[InlineKeyboardButton]] = []
     for sweet in sweets:
         buttons.append(
             [
                 InlineKeyboardButton(
-                    text=f"{sweet.name} — {_format_currency(sweet.price_rub)}",
+                    text=BUTTON_LABEL[sweet.id],
                     callback_data=f"item:{sweet.id}",
                 )
             ]
         )
 
-    buttons.append([InlineKeyboardButton("⬅️ Назад", callback_data="menu")])
+    buttons.append([_BTN_BACK_MENU])
     return InlineKeyboardMarkup(buttons)
 
 
-def _build_item_keyboard(sweet: Sweet) -> InlineKeyboardMarkup:
+@lru_cache(maxsize=None)
+def _build_item_keyboard(sweet_id: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
             [
-                InlineKeyboardButton("Добавить в корзину", callback_data=f"add:{sweet.id}"),
-            ],
-            [
-                InlineKeyboardButton("🛒 Открыть корзину", callback_data="cart:view"),
-                InlineKeyboardButton("⬅️ Назад", callback_data="menu"),
+                InlineKeyboardButton("Добавить в корзину", callback_data=f"add:{sweet_id}"),
             ],
+            [_BTN_CART_OPEN, _BTN_BACK_MENU],
         ]
     )
 
 
 def _build_cart_keyboard(cart: Dict[str, int]) -> InlineKeyboardMarkup:
-    buttons: List[List[InlineKeyboardButton]] = []
-    if cart:
-        buttons.append(
-            [
-                InlineKeyboardButton("Очистить", callback_data="cart:clear"),
-                InlineKeyboardButton("Оформить заказ", callback_data="cart:checkout"),
-            ]
-        )
-    buttons.append([InlineKeyboardButton("⬅️ К товарам", callback_data="menu")])
-    return InlineKeyboardMarkup(buttons)
+    return _CART_KEYBOARD_FILLED if cart else _CART_KEYBOARD_EMPTY
 
 
 def _category_title(category: str) -> str:
-    titles = {
-        "chocolate": "Шоколад",
-        "caramel": "Карамель",
-        "cookies": "Печенье",
-    }
-    return titles.get(category, category)
+    return _CATEGORY_TITLES.get(category, category)
 
 
 def _find_sweet_by_id(sweet_id: str) -> Sweet | None:
-    for sweets in SWEET_CATALOGUE.values():
-        for sweet in sweets:
-            if sweet.id == sweet_id:
-                return sweet
-    return None
+    return SWEETS_BY_ID.get(sweet_id)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle the /start command."""
 
-    user_first_name = update.effective_user.first_name if update.effective_user else "гость"
+    user_first_name = (
+        html.escape(update.effective_user.first_name) if update.effective_user else "гость"
+    )
     text = (
         f"Привет, {user_first_name}! 👋\n"
         "Добро пожаловать в Sweet Shop — наш уютный магазин сладостей."
@@ -221,135 +253,217 @@ async def cart_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     cart = _get_cart(context.user_data)
     message = update.effective_message
     if message:
-        await message.reply_text(_format_cart(cart), reply_markup=_build_cart_keyboard(cart))
+        await message.reply_text(
+            _render_cart(context.user_data, cart),
+            reply_markup=_build_cart_keyboard(cart),
+        )
 
 
 def _format_cart(cart: Dict[str, int]) -> str:
     if not cart:
         return "Ваша корзина пока пуста. Загляните в меню и добавьте что-нибудь вкусное!"
 
-    lines = ["🛒 Ваша корзина:"]
-    total = 0
-    for sweet_id, quantity in cart.items():
-        sweet = _find_sweet_by_id(sweet_id)
-        if not sweet:
-            continue
-        line_total = sweet.price_rub * quantity
-        total += line_total
-        lines.append(
-            f"• {sweet.name} — {quantity} шт. × {_format_currency(sweet.price_rub)}"
-            f" = {_format_currency(line_total)}"
-        )
-
-    lines.append("")
-    lines.append(f"Итого к оплате: {_format_currency(total)}")
-    lines.append(
+    entries = [
+        (sweet, quantity)
+        for sweet_id, quantity in cart.items()
+        if (sweet := SWEETS_BY_ID.get(sweet_id))
+    ]
+    total = sum(sweet.price_rub * quantity for sweet, quantity in entries)
+    body = "".join(
+        f"\n• {sweet.name} — {quantity} шт. × {sweet.price_rub} ₽"
+        f" = {sweet.price_rub * quantity} ₽"
+        for sweet, quantity in entries
+    )
+    return (
+        f"🛒 Ваша корзина:{body}\n\n"
+        f"Итого к оплате: {total} ₽\n"
         "Для завершения заказа нажмите «Оформить заказ» и наш менеджер свяжется"
         " с вами."
     )
-    return "\n".join(lines)
 
 
-async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Handle button presses from the inline keyboards."""
+def _render_cart(user_data: MutableMapping[str, object], cart: Dict[str, int]) -> str:
+    """Return ``_format_cart(cart)``, reusing the last rendering if unchanged."""
 
-    if not update.callback_query:
+    # Lines are rendered in insertion order, so the fingerprint keeps it too.
+    fingerprint = tuple(cart.items())
+    cached = user_data.get("cart_cache")
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    text = _format_cart(cart)
+    user_data["cart_cache"] = (fingerprint, text)
+    return text
+
+
+async def _on_menu(query: CallbackQuery) -> None:
+    await query.edit_message_text(
+        text="Выбирайте сладости:",
+        reply_markup=_build_categories_keyboard(),
+    )
+
+
+async def _on_category(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, category: str) -> None:
+    sweets = SWEET_CATALOGUE.get(category)
+    if not sweets:
+        await query.answer("Категория не найдена", show_alert=True)
         return
 
-    query = update.callback_query
-    await query.answer()
+    await query.edit_message_text(
+        text=f"Категория: {_category_title(category)}",
+        reply_markup=_build_sweets_keyboard(category),
+    )
 
-    data = query.data or ""
-    LOGGER.debug("Received callback data: %s", data)
 
-    if data == "menu":
-        await query.edit_message_text(
-            text="Выбирайте сладости:",
-            reply_markup=_build_categories_keyboard(),
+async def _on_item(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, sweet_id: str) -> None:
+    sweet = _find_sweet_by_id(sweet_id)
+    if not sweet:
+        await query.answer("Товар не найден", show_alert=True)
+        return
+
+    await query.edit_message_text(
+        text=ITEM_HTML[sweet_id],
+        reply_markup=_build_item_keyboard(sweet_id),
+    )
+
+
+async def _on_add(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, sweet_id: str) -> None:
+    sweet = _find_sweet_by_id(sweet_id)
+    if not sweet:
+        await query.answer("Товар не найден", show_alert=True)
+        return
+
+    cart = _get_cart(context.user_data)
+    cart[sweet_id] += 1
+    # The toast is purely informational, so it is sent in the background while
+    # the markup edit is coalesced with any further taps in quick succession.
+    context.application.create_task(query.answer("Добавлено в корзину"))
+    _schedule_add_edit(query, context, sweet)
+
+
+def _schedule_add_edit(
+    query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, sweet: Sweet
+) -> None:
+    """Debounce the keyboard refresh that follows an ``add:`` press."""
+
+    reply_markup = _build_item_keyboard(sweet.id)
+    message = query.message
+    if message is None:
+        context.application.create_task(
+            query.edit_message_reply_markup(reply_markup=reply_markup)
         )
         return
 
-    if data.startswith("cat:"):
-        category = data.split(":", 1)[1]
-        sweets = SWEET_CATALOGUE.get(category)
-        if not sweets:
-            await query.answer("Категория не найдена", show_alert=True)
-            return
+    key = (message.chat_id, message.message_id)
+    pending = _PENDING_ADD_EDITS.pop(key, None)
+    if pending is not None:
+        pending.cancel()
+
+    _PENDING_ADD_EDITS[key] = asyncio.get_running_loop().call_later(
+        ADD_DEBOUNCE_SECONDS, _flush_add_edit, context.application, key, reply_markup
+    )
+
+
+def _flush_add_edit(
+    application: Application,
+    key: Tuple[int, int],
+    reply_markup: InlineKeyboardMarkup,
+) -> None:
+    _PENDING_ADD_EDITS.pop(key, None)
+    if not application.running:
+        return
+
+    chat_id, message_id = key
+    application.create_task(
+        application.bot.edit_message_reply_markup(
+            chat_id=chat_id, message_id=message_id, reply_markup=reply_markup
+        )
+    )
+
+
+async def _cancel_pending_add_edits(application: Application) -> None:
+    """Drop keyboard refreshes that are still waiting when the bot stops."""
 
+    for handle in _PENDING_ADD_EDITS.values():
+        handle.cancel()
+    _PENDING_ADD_EDITS.clear()
+
+
+async def _on_cart(query: CallbackQuery, context: ContextTypes.DEFAULT_TYPE, action: str) -> None:
+    cart = _get_cart(context.user_data)
+
+    if action == "view":
         await query.edit_message_text(
-            text=f"Категория: {_category_title(category)}",
-            reply_markup=_build_sweets_keyboard(category),
+            text=_render_cart(context.user_data, cart),
+            reply_markup=_build_cart_keyboard(cart),
         )
         return
 
-    if data.startswith("item:"):
-        sweet_id = data.split(":", 1)[1]
-        sweet = _find_sweet_by_id(sweet_id)
-        if not sweet:
-            await query.answer("Товар не найден", show_alert=True)
+    if action == "clear":
+        cart.clear()
+        await query.edit_message_text(
+            text="Корзина очищена. Чем еще можем порадовать?",
+            reply_markup=_build_cart_keyboard(cart),
+        )
+        return
+
+    if action == "checkout":
+        if not cart:
+            await query.answer("Корзина пуста", show_alert=True)
             return
 
-        description = (
-            f"<b>{sweet.name}</b>\n"
-            f"Цена: {_format_currency(sweet.price_rub)}\n\n"
-            f"{sweet.description}"
-        )
+        # Clear before awaiting so that an ``add:`` processed concurrently
+        # during the edit is kept for the next order.
+        cart.clear()
         await query.edit_message_text(
-            text=description,
-            parse_mode=ParseMode.HTML,
-            reply_markup=_build_item_keyboard(sweet),
+            text=(
+                "Спасибо за заказ! 🎉\n"
+                "Наш менеджер свяжется с вами в ближайшее время для"
+                " уточнения деталей доставки и оплаты."
+            ),
+            reply_markup=_build_categories_keyboard(),
         )
         return
 
-    if data.startswith("add:"):
-        sweet_id = data.split(":", 1)[1]
-        sweet = _find_sweet_by_id(sweet_id)
-        if not sweet:
-            await query.answer("Товар не найден", show_alert=True)
-            return
+    context.application.create_task(query.answer("Неизвестная команда", show_alert=True))
+
+
+CallbackHandlerFunc = Callable[
+    [CallbackQuery, ContextTypes.DEFAULT_TYPE, str], Awaitable[None]
+]
 
-        cart = _get_cart(context.user_data)
-        cart[sweet_id] = cart.get(sweet_id, 0) + 1
-        await query.answer("Добавлено в корзину")
-        await query.edit_message_reply_markup(reply_markup=_build_item_keyboard(sweet))
+CALLBACK_HANDLERS: Dict[str, CallbackHandlerFunc] = {
+    "cat": _on_category,
+    "item": _on_item,
+    "add": _on_add,
+    "cart": _on_cart,
+}
+
+
+async def handle_callbacks(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handle button presses from the inline keyboards."""
+
+    if not update.callback_query:
         return
 
-    if data.startswith("cart:"):
-        action = data.split(":", 1)[1]
-        cart = _get_cart(context.user_data)
+    query = update.callback_query
+    await query.answer()
 
-        if action == "view":
-            await query.edit_message_text(
-                text=_format_cart(cart),
-                reply_markup=_build_cart_keyboard(cart),
-            )
-            return
+    data = query.data or ""
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug("Received callback data: %s", data)
 
-        if action == "clear":
-            cart.clear()
-            await query.edit_message_text(
-                text="Корзина очищена. Чем еще можем порадовать?",
-                reply_markup=_build_cart_keyboard(cart),
-            )
-            return
+    if data == "menu":
+        await _on_menu(query)
+        return
 
-        if action == "checkout":
-            if not cart:
-                await query.answer("Корзина пуста", show_alert=True)
-                return
-
-            await query.edit_message_text(
-                text=(
-                    "Спасибо за заказ! 🎉\n"
-                    "Наш менеджер свяжется с вами в ближайшее время для"
-                    " уточнения деталей доставки и оплаты."
-                ),
-                reply_markup=_build_categories_keyboard(),
-            )
-            cart.clear()
-            return
+    prefix, sep, arg = data.partition(":")
+    handler = CALLBACK_HANDLERS.get(prefix) if sep else None
+    if handler is None:
+        context.application.create_task(query.answer("Неизвестная команда", show_alert=True))
+        return
 
-    await query.answer("Неизвестная команда", show_alert=True)
+    await handler(query, context, arg)
 
 
 async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -365,11 +479,6 @@ async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 def main() -> None:
     """Entrypoint for the bot application."""
 
-    logging.basicConfig(
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-        level=logging.INFO,
-    )
-
     token = os.getenv("TELEGRAM_TOKEN")
     if not token:
         raise RuntimeError(
@@ -377,7 +486,17 @@ def main() -> None:
             "Export the bot token before starting the bot."
         )
 
-    application = ApplicationBuilder().token(token).build()
+    # Updates, including several from the same user, are processed
+    # concurrently.  Handlers must therefore read and modify ``user_data``
+    # without an ``await`` between the check and the change.
+    application = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(True)
+        .defaults(Defaults(parse_mode=ParseMode.HTML, block=False))
+        .post_stop(_cancel_pending_add_edits)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
@@ -391,5 +510,9 @@ def main() -> None:
 
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.INFO,
+    )
     main()
 